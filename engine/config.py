@@ -2,6 +2,9 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     POSTGRES_DSN: str 
+    # Set to 0 when connecting through PgBouncer in transaction pooling mode; the scheduler then
+    # also stops holding named prepared statements on a dedicated connection.
+    POSTGRES_STATEMENT_CACHE_SIZE: int = 100
     MASTER_LIST_POLL_INTERVAL_S: int = 60
     MASTER_LIST_MAX_BACKOFF_S: int = 300
     POLL_INTERVAL_ACTIVE_S: int = 20
@@ -9,7 +12,17 @@ class Settings(BaseSettings):
     POLL_INTERVAL_OFFLINE_S: int = 900
     OFFLINE_FAILURE_THRESHOLD: int = 3
     SERVER_QUERY_TIMEOUT_S: float = 4.0
+    # The listed port gets this long before only the port 23000 query is awaited.
+    SERVER_QUERY_FAST_TIMEOUT_S: float = 1.0
+    # Receive buffer for the shared UDP query socket; Linux caps it at net.core.rmem_max.
+    SERVER_QUERY_RECV_BUFFER_BYTES: int = 4 * 1024 * 1024
     WORKER_COUNT: int = 200
+    SNAPSHOT_FLUSH_INTERVAL_S: float = 0.1
+    SNAPSHOT_BATCH_SIZE: int = 500
+    # Polls wait for the snapshot flusher once this many snapshots are queued.
+    SNAPSHOT_QUEUE_MAX_SIZE: int = 5000
+    WRITE_BATCH_INTERVAL_S: float = 0.1
+    WRITE_BATCH_SIZE: int = 100
 
     class Config:
         env_file = ".env"
@@ -1,213 +1,339 @@
-import json
+import asyncio
+import hashlib
+import orjson
 import logging
 from datetime import datetime, timezone
 import asyncpg
-from typing import Dict, List
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+from .config import settings
 
 logger = logging.getLogger(__name__)
 
 
+_SNAPSHOT_COLUMNS = ['server_id', 'timestamp', 'data', 'raw', 'content_hash']
+_INSERT_SNAPSHOT_QUERY = (
+    "INSERT INTO server_snapshots (server_id, timestamp, data, raw, content_hash) VALUES ($1, $2, $3, $4, $5);"
+)
+_INGEST_QUERY = "SELECT * FROM ingest_server($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11);"
+
+_snapshot_queue: Optional[asyncio.Queue] = None
+
+
+class Exclusions(NamedTuple):
+    """Immutable exclusion sets; the scheduler swaps in a new instance on each refresh."""
+    gametypes: FrozenSet[str] = frozenset()
+    player_names: FrozenSet[str] = frozenset()
+    server_ids: FrozenSet[Tuple[str, int]] = frozenset()
+
+
+class _PreparedIngest(NamedTuple):
+    """One normalized poll result, ready for ingest_server and the snapshot diff."""
+    ip: str
+    port: int
+    timestamp: datetime
+    ingest_args: Tuple
+    normalized_data: Dict
+    raw_payload: Dict
+    data_json: bytes
+    raw_json: bytes
+    content_hash: bytes
+
+
+class _SnapshotRow(NamedTuple):
+    # Field order matches _SNAPSHOT_COLUMNS and _INSERT_SNAPSHOT_QUERY.
+    server_id: int
+    timestamp: datetime
+    data: bytes
+    raw: bytes
+    content_hash: bytes
+
+
+def _get_snapshot_queue() -> asyncio.Queue:
+    global _snapshot_queue
+    if _snapshot_queue is None:
+        # Bounded so a slow database pushes back on the workers instead of buffering without limit.
+        _snapshot_queue = asyncio.Queue(maxsize=settings.SNAPSHOT_QUEUE_MAX_SIZE)
+    return _snapshot_queue
+
+
+def _content_hash(data_json: bytes, raw_json: bytes) -> bytes:
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(data_json)
+    hasher.update(raw_json)
+    return hasher.digest()
+
+
 def _coerce_int(value, default: int = 0) -> int:
+    # Status fields are nearly always plain digit strings; parse those, ints and empty values
+    # before falling back to the try block.
+    if type(value) is str and value.isascii() and value.isdigit():
+        return int(value)
+    if type(value) is int:
+        return value
+    if value is None or value == "":
+        return default
     try:
-        if value in (None, ""):
-            return default
         return int(value)
     except (TypeError, ValueError):
         return default
 
 
-async def process_server_success(pool: asyncpg.Pool, ip: str, port: int, raw_data, exclusions: Dict):
-    timestamp = datetime.now(timezone.utc).replace(microsecond=0)
+def _prepare_ingest(ip: str, port: int, raw_data, exclusions: Exclusions, timestamp: datetime) -> Optional[_PreparedIngest]:
+    """Normalizes one poll result. Returns None when the server is excluded."""
     info = raw_data.info
     players_raw = raw_data.players
 
-    server_identifier = f"{ip}:{port}"
-    excluded_servers = exclusions.get('server_id', set())
-    if server_identifier in excluded_servers or (ip, port) in excluded_servers:
+    if (ip, port) in exclusions.server_ids:
         logger.info("Skipping server %s:%s because it is excluded by server ID.", ip, port)
-        return
+        return None
 
     gametype = info.get('gametype', 'N/A')
-    if gametype in exclusions.get('gametype', set()):
+    if gametype in exclusions.gametypes:
         logger.info("Skipping server %s:%s due to excluded gametype '%s'.", ip, port, gametype)
-        return
+        return None
 
     # --- Normalize Player Data ---
+    # Locals avoid repeated global/attribute lookups in this per-player loop.
     normalized_players = []
-    excluded_player_names = exclusions.get('player_name', set())
+    append_player = normalized_players.append
+    # Lowercased name -> player; the names sent to ingest_server for session tracking.
+    current_index: Dict[str, Dict] = {}
+    coerce_int = _coerce_int
+    excluded_player_names = exclusions.player_names
     for p in players_raw:
-        player_name = p.get('player', 'N/A')
+        get = p.get
+        player_name = get('player', 'N/A')
         if player_name in excluded_player_names:
             continue
-        normalized_players.append({
+        player = {
             "name": player_name,
-            "keyhash": p.get('keyhash', None),
-            "score": _coerce_int(p.get('score')),
-            "ping": _coerce_int(p.get('ping')),
-            "team": _coerce_int(p.get('team')),
-            "kills": _coerce_int(p.get('kills')),
-            "deaths": _coerce_int(p.get('deaths')),
-        })
+            "keyhash": get('keyhash', None),
+            "score": coerce_int(get('score')),
+            "ping": coerce_int(get('ping')),
+            "team": coerce_int(get('team')),
+            "kills": coerce_int(get('kills')),
+            "deaths": coerce_int(get('deaths')),
+        }
+        append_player(player)
+        if player_name:
+            current_index[player_name.lower()] = player
 
     # --- THIS IS THE FIX ---
     # Create the final info object that will be saved to the 'servers' table.
     # It starts with the raw server info and adds the processed player list.
     info_to_save = info.copy()
     info_to_save['players'] = normalized_players
-    info_jsonb = json.dumps(info_to_save)
     # --- END OF FIX ---
 
     hostname = info.get('hostname', 'N/A')
     mapname = info.get('mapname', 'N/A').lower()
     active_mod = info.get('active_mods', 'N/A')
 
-    normalized_players = []
-    excluded_player_names = exclusions.get('player_name', set())
-    for p in players_raw:
-        player_name = p.get('player', 'N/A')
-        if player_name in excluded_player_names:
-            continue
+    normalized_data = {"mapname": mapname, "players": normalized_players}
+    raw_payload = {'info': raw_data.info, 'players': raw_data.players}
+    # Serialized once: the same bytes are hashed here and written by the snapshot flusher.
+    data_json = orjson.dumps(normalized_data)
+    raw_json = orjson.dumps(raw_payload)
+    content_hash = _content_hash(data_json, raw_json)
+
+    # ingest_server upserts the server (with the correct 'info_to_save' which contains the
+    # player list), syncs open player sessions, and returns the latest snapshot's hash.
+    players = list(current_index.values())
+    ingest_args = (
+        ip,
+        port,
+        timestamp,
+        hostname,
+        active_mod,
+        gametype,
+        mapname,
+        info_to_save,
+        [player['name'] for player in players],
+        list(current_index),
+        [player['keyhash'] for player in players],
+    )
+    return _PreparedIngest(
+        ip=ip,
+        port=port,
+        timestamp=timestamp,
+        ingest_args=ingest_args,
+        normalized_data=normalized_data,
+        raw_payload=raw_payload,
+        data_json=data_json,
+        raw_json=raw_json,
+        content_hash=content_hash,
+    )
 
-        normalized_players.append({
-            "name": player_name,
-            "keyhash": p.get('keyhash', None),
-            "score": _coerce_int(p.get('score')),
-            "ping": _coerce_int(p.get('ping')),
-            "team": _coerce_int(p.get('team')),
-            "kills": _coerce_int(p.get('kills')),
-            "deaths": _coerce_int(p.get('deaths')),
-        })
 
-    info_to_save = info.copy()
-    info_to_save['players'] = normalized_players
-    info_jsonb = json.dumps(info_to_save)
-
-    # This INSERT/UPDATE now uses the correct 'info_jsonb' which contains the player list.
-    server_id = await pool.fetchval("""
-        INSERT INTO servers (ip, port, hostname, status, last_seen, first_seen, consecutive_failures, active_mod, gametype, info)
-        VALUES ($1, $2, $3, 'online', $4, $4, 0, $5, $6, $7)
-        ON CONFLICT (ip, port) DO UPDATE SET
-            hostname = EXCLUDED.hostname, status = 'online', last_seen = EXCLUDED.last_seen,
-            consecutive_failures = 0, active_mod = EXCLUDED.active_mod,
-            gametype = EXCLUDED.gametype, info = EXCLUDED.info
-        RETURNING id;
-    """, ip, port, hostname, timestamp, active_mod, gametype, info_jsonb)
-
-    if mapname != 'n/a':
-        await pool.execute("INSERT INTO unique_maps (id) VALUES ($1) ON CONFLICT DO NOTHING;", mapname)
-
-    previous_snapshot = await pool.fetchrow(
-        "SELECT data, raw FROM server_snapshots WHERE server_id = $1 ORDER BY timestamp DESC LIMIT 1;",
-        server_id
+def _snapshot_record(ingest_row, prepared: _PreparedIngest) -> Optional[_SnapshotRow]:
+    """Returns the server_snapshots row to write, or None when the data is unchanged."""
+    previous_hash = ingest_row['prev_content_hash']
+    if previous_hash is not None:
+        unchanged = previous_hash == prepared.content_hash
+    else:
+        # Snapshots written before content hashing have no digest; their payloads are returned instead.
+        unchanged = (
+            ingest_row['prev_data'] == prepared.normalized_data
+            and ingest_row['prev_raw'] == prepared.raw_payload
+        )
+
+    if unchanged:
+        logger.debug("Skipping snapshot insert for %s:%s; data unchanged.", prepared.ip, prepared.port)
+        return None
+    return _SnapshotRow(
+        server_id=ingest_row['ingested_server_id'],
+        timestamp=prepared.timestamp,
+        data=prepared.data_json,
+        raw=prepared.raw_json,
+        content_hash=prepared.content_hash,
     )
 
-    previous_players: List[Dict] = []
-    previous_data = None
-    previous_raw = None
-    if previous_snapshot:
-        previous_data = previous_snapshot['data']
-        if isinstance(previous_data, str):
-            previous_data = json.loads(previous_data)
-        previous_raw = previous_snapshot['raw']
-        if isinstance(previous_raw, str):
-            previous_raw = json.loads(previous_raw)
-        previous_players = previous_data.get('players', []) if previous_data else []
 
-    await _update_player_sessions(pool, server_id, previous_players, normalized_players, timestamp)
+async def process_server_success(pool: asyncpg.Pool, ip: str, port: int, raw_data, exclusions: Exclusions) -> bool:
+    """Records a successful poll. Returns True when a new snapshot was queued."""
+    timestamp = datetime.now(timezone.utc).replace(microsecond=0)
+    prepared = _prepare_ingest(ip, port, raw_data, exclusions, timestamp)
+    if prepared is None:
+        return False
 
-    normalized_data = {"mapname": mapname, "players": normalized_players}
-    raw_payload = {'info': raw_data.info, 'players': raw_data.players}
+    ingest_row = await pool.fetchrow(_INGEST_QUERY, *prepared.ingest_args)
+    record = _snapshot_record(ingest_row, prepared)
+    if record is None:
+        return False
 
-    if previous_data == normalized_data and previous_raw == raw_payload:
-        logger.debug("Skipping snapshot insert for %s:%s; data unchanged.", ip, port)
-        return
+    # Written by the snapshot flusher in batches; see run_snapshot_flusher.
+    await _get_snapshot_queue().put(record)
+    return True
 
-    await pool.execute("""
-        INSERT INTO server_snapshots (server_id, timestamp, data, raw)
-        VALUES ($1, $2, $3, $4);
-    """, server_id, timestamp, json.dumps(normalized_data), json.dumps(raw_payload))
 
+async def process_batch(pool: asyncpg.Pool, items: List, exclusions: Exclusions) -> int:
+    """Records a batch of (ip, port, raw_data) poll results in one transaction.
 
-async def process_server_failure(pool: asyncpg.Pool, ip: str, port: int):
+    Returns the number of new snapshots queued. If the batch fails, each result is
+    retried on its own so one bad server doesn't drop the rest.
+    """
+    timestamp = datetime.now(timezone.utc).replace(microsecond=0)
+    prepared_items = []
+    for ip, port, raw_data in items:
+        prepared = _prepare_ingest(ip, port, raw_data, exclusions, timestamp)
+        if prepared is not None:
+            prepared_items.append(prepared)
+    if not prepared_items:
+        return 0
+
+    records = []
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # fetchmany pipelines every call in one exchange; ingest_server returns exactly
+                # one row per call, so rows line up with prepared_items.
+                ingest_rows = await conn.fetchmany(
+                    _INGEST_QUERY, [prepared.ingest_args for prepared in prepared_items]
+                )
+        for ingest_row, prepared in zip(ingest_rows, prepared_items):
+            record = _snapshot_record(ingest_row, prepared)
+            if record is not None:
+                records.append(record)
+    except Exception:
+        logger.exception("Batch write of %d servers failed; retrying individually.", len(prepared_items))
+        written = 0
+        for ip, port, raw_data in items:
+            try:
+                if await process_server_success(pool, ip, port, raw_data, exclusions):
+                    written += 1
+            except Exception:
+                logger.exception("Failed to record poll result for %s:%s.", ip, port)
+        return written
+
+    # Queued only after the commit, so a rolled-back batch never reaches the flusher.
+    queue = _get_snapshot_queue()
+    for record in records:
+        await queue.put(record)
+    return len(records)
+
+
+async def process_server_failure(pool: asyncpg.Pool, ip: str, port: int) -> bool:
+    """Records a failed poll. Returns True when open player sessions were closed."""
     timestamp = datetime.now(timezone.utc).replace(microsecond=0)
-    from .config import settings
-
-    failure_row = await pool.fetchrow(
-        """
-        INSERT INTO servers (ip, port, status, last_seen, first_seen, consecutive_failures)
-        VALUES ($1, $2, 'offline', $3, $3, 1)
-        ON CONFLICT (ip, port) DO UPDATE SET
-            last_seen = EXCLUDED.last_seen,
-            consecutive_failures = servers.consecutive_failures + 1,
-            status = CASE
-                WHEN servers.consecutive_failures + 1 >= $4 THEN 'offline'
-                ELSE servers.status
-            END
-        RETURNING id, consecutive_failures, status;
-        """,
-        ip,
-        port,
-        timestamp,
-        settings.OFFLINE_FAILURE_THRESHOLD,
-    )
 
-    if failure_row and failure_row['consecutive_failures'] >= settings.OFFLINE_FAILURE_THRESHOLD:
-        server_id = failure_row['id']
-        previous_snapshot = await pool.fetchrow(
-            "SELECT data FROM server_snapshots WHERE server_id = $1 ORDER BY timestamp DESC LIMIT 1;",
-            server_id,
-        )
-        previous_players: List[Dict] = []
-        if previous_snapshot:
-            snapshot_data = previous_snapshot['data']
-            if isinstance(snapshot_data, str):
-                snapshot_data = json.loads(snapshot_data)
-            if snapshot_data:
-                previous_players = snapshot_data.get('players', [])
-
-        await _update_player_sessions(pool, server_id, previous_players, [], timestamp)
-
-
-async def _update_player_sessions(pool: asyncpg.Pool, server_id: int, prev_players: List[Dict], current_players: List[Dict], timestamp: datetime):
-    def _build_index(players: List[Dict]):
-        index = {}
-        for player in players:
-            raw_name = player.get("name")
-            if not raw_name:
-                continue
-            index[raw_name.lower()] = player
-        return index
-
-    previous_index = _build_index(prev_players)
-    current_index = _build_index(current_players)
-
-    prev_names_norm = set(previous_index.keys())
-    current_names_norm = set(current_index.keys())
-
-    joined_players = current_names_norm - prev_names_norm
-    left_players = prev_names_norm - current_names_norm
-
-    if left_players:
-        await pool.execute("""
-            UPDATE player_sessions SET leave_ts = $1
-            WHERE server_id = $2 AND player_name_norm = ANY($3::VARCHAR[]) AND leave_ts IS NULL;
-        """, timestamp, server_id, list(left_players))
-
-    if joined_players:
-        new_sessions_data = []
-        for norm_name in joined_players:
-            player = current_index.get(norm_name)
-            if not player:
-                continue
-            raw_name = player.get("name")
-            if not raw_name:
-                continue
-            new_sessions_data.append(
-                (server_id, raw_name, norm_name, timestamp, player.get('keyhash'))
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            failure_row = await conn.fetchrow(
+                """
+                INSERT INTO servers (ip, port, status, last_seen, first_seen, consecutive_failures)
+                VALUES ($1, $2, 'offline', $3, $3, 1)
+                ON CONFLICT (ip, port) DO UPDATE SET
+                    last_seen = EXCLUDED.last_seen,
+                    consecutive_failures = servers.consecutive_failures + 1,
+                    status = CASE
+                        WHEN servers.consecutive_failures + 1 >= $4 THEN 'offline'
+                        ELSE servers.status
+                    END
+                RETURNING id, consecutive_failures, status;
+                """,
+                ip,
+                port,
+                timestamp,
+                settings.OFFLINE_FAILURE_THRESHOLD,
             )
 
-        if new_sessions_data:
-            await pool.executemany("""
-                INSERT INTO player_sessions (server_id, player_name, player_name_norm, join_ts, keyhash)
-                VALUES ($1, $2, $3, $4, $5);
-            """, new_sessions_data)
+            if failure_row and failure_row['consecutive_failures'] >= settings.OFFLINE_FAILURE_THRESHOLD:
+                # An offline server has no players; close every session still open on it.
+                result = await conn.execute(
+                    "UPDATE player_sessions SET leave_ts = $1 WHERE server_id = $2 AND leave_ts IS NULL;",
+                    timestamp,
+                    failure_row['id'],
+                )
+                return result != 'UPDATE 0'
+
+    return False
+
+
+async def run_snapshot_flusher(pool: asyncpg.Pool):
+    """Writes queued snapshots to server_snapshots with COPY until stopped."""
+    queue = _get_snapshot_queue()
+    while True:
+        record = await queue.get()
+        if record is None:
+            return
+
+        # Give concurrently finishing polls a moment so their rows share this COPY.
+        await asyncio.sleep(settings.SNAPSHOT_FLUSH_INTERVAL_S)
+        batch = [record]
+        stopping = False
+        while len(batch) < settings.SNAPSHOT_BATCH_SIZE and not queue.empty():
+            record = queue.get_nowait()
+            if record is None:
+                stopping = True
+                break
+            batch.append(record)
+
+        await _write_snapshots(pool, batch)
+        if stopping:
+            return
+
+
+async def stop_snapshot_flusher():
+    """Asks run_snapshot_flusher to write everything queued so far and return."""
+    await _get_snapshot_queue().put(None)
+
+
+async def _write_snapshots(pool: asyncpg.Pool, batch: List):
+    try:
+        async with pool.acquire() as conn:
+            await conn.copy_records_to_table('server_snapshots', records=batch, columns=_SNAPSHOT_COLUMNS)
+        logger.debug("Wrote %d snapshots.", len(batch))
+        return
+    except Exception:
+        logger.exception("COPY of %d snapshots failed; retrying individually.", len(batch))
+
+    # One bad row fails the whole COPY; insert the rest one by one so only that row is lost.
+    try:
+        async with pool.acquire() as conn:
+            for record in batch:
+                try:
+                    await conn.execute(_INSERT_SNAPSHOT_QUERY, *record)
+                except Exception:
+                    logger.exception("Failed to write snapshot for server_id %s.", record.server_id)
+    except Exception:
+        logger.exception("Failed to write a batch of %d snapshots.", len(batch))
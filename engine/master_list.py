@@ -1,5 +1,6 @@
 import aiohttp
 import logging
+import orjson
 from typing import List, Tuple, Optional
 
 MASTER_SERVER_URL = "http://master.bf1942.org/json"
@@ -13,16 +14,20 @@ _session: Optional[aiohttp.ClientSession] = None
 async def _get_session() -> aiohttp.ClientSession:
     global _session
     if _session is None or _session.closed:
-        _session = aiohttp.ClientSession()
+        # A single keep-alive connection to the master server is reused across polls.
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=1, ttl_dns_cache=600, enable_cleanup_closed=True),
+            timeout=aiohttp.ClientTimeout(total=10),
+        )
     return _session
 
 
 async def fetch_servers() -> Optional[List[Tuple[str, int]]]:
     session = await _get_session()
     try:
-        async with session.get(MASTER_SERVER_URL, timeout=10) as response:
+        async with session.get(MASTER_SERVER_URL) as response:
             response.raise_for_status()
-            data = await response.json()
+            data = orjson.loads(await response.read())
             servers = [(item[0], int(item[1])) for item in data if isinstance(item, list) and len(item) == 2]
             return servers
     except Exception:
@@ -1,6 +1,8 @@
 import asyncio
+import heapq
 import logging
-import time
+import random
+from typing import List, Set, Tuple
 from .config import settings
 from . import master_list, server_querier, data_processor
 
@@ -8,34 +10,88 @@ from . import master_list, server_querier, data_processor
 logger = logging.getLogger(__name__)
 
 
-def _safe_int(value, default: int = 0) -> int:
-    try:
-        if value in (None, ""):
-            return default
-        return int(value)
-    except (TypeError, ValueError):
-        return default
+_SEED_BATCH_SIZE = 1000
+_EXCLUSIONS_QUERY = "SELECT type, value, server_ip, server_port FROM exclusions;"
+_SERVERS_QUERY = "SELECT ip, port FROM servers;"
+
 
 class Scheduler:
     def __init__(self, db_manager):
-        self._queue = asyncio.PriorityQueue()
-        self._known_servers = set()
+        # (next_poll_time, ip, port) min-heap; only the dispatcher pops from it.
+        self._heap: List[Tuple[float, str, int]] = []
+        self._waker = asyncio.Event()
+        self._known_servers: Set[Tuple[str, int]] = set()
         self._db_manager = db_manager
         self._pool = None
-        self._exclusions = {'gametype': set(), 'player_name': set(), 'server_id': set()}
+        # Poll deadlines use the event loop's monotonic clock, so wall-clock jumps don't skew them.
+        self._loop = None
+        # Dedicated connection holding the scheduler's prepared read queries. Named statements
+        # don't survive PgBouncer transaction pooling, so they are skipped when the cache is off.
+        self._prepared_reads = settings.POSTGRES_STATEMENT_CACHE_SIZE > 0
+        self._read_conn = None
+        self._exclusions_stmt = None
+        self._servers_stmt = None
+        # Replaced wholesale on each refresh, so readers always see one consistent set of exclusions.
+        self._exclusions = data_processor.Exclusions()
         self._parked_servers = set()
+        # Polls that changed stats data since the last materialized view refresh.
+        self._writes_since_refresh = 0
         self._worker_count = settings.WORKER_COUNT
+        self._work_queue = asyncio.Queue(maxsize=self._worker_count)
+        # (ip, port, status) poll results waiting for the writer to record them in one transaction.
+        self._write_batch = asyncio.Queue(maxsize=self._worker_count)
         self._master_list_poll_interval = settings.MASTER_LIST_POLL_INTERVAL_S
         self._master_list_max_backoff = settings.MASTER_LIST_MAX_BACKOFF_S
 
+    def _push(self, next_poll_time: float, ip: str, port: int):
+        entry = (next_poll_time, ip, port)
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            # New earliest deadline; wake the dispatcher so it re-arms its timer.
+            self._waker.set()
+
     def _is_server_excluded(self, ip: str, port: int) -> bool:
-        excluded_servers = self._exclusions.get('server_id', set())
-        server_identifier = f"{ip}:{port}"
-        return server_identifier in excluded_servers or (ip, port) in excluded_servers
+        return (ip, port) in self._exclusions.server_ids
+
+    async def _prepare_read_statements(self):
+        if self._read_conn is not None and not self._read_conn.is_closed():
+            return
+        await self._release_read_conn()
+        self._read_conn = await self._pool.acquire()
+        self._exclusions_stmt = await self._read_conn.prepare(_EXCLUSIONS_QUERY)
+        self._servers_stmt = await self._read_conn.prepare(_SERVERS_QUERY)
+
+    async def _release_read_conn(self):
+        if self._read_conn is None:
+            return
+        read_conn, self._read_conn = self._read_conn, None
+        try:
+            await self._pool.release(read_conn)
+        except Exception:
+            logger.exception("Error releasing the scheduler read connection.")
+
+    async def _fetch_exclusion_rows(self):
+        if not self._prepared_reads:
+            return await self._pool.fetch(_EXCLUSIONS_QUERY)
+        await self._prepare_read_statements()
+        return await self._exclusions_stmt.fetch()
+
+    async def _iter_server_rows(self):
+        # Stream rows through a server-side cursor instead of materializing the whole table;
+        # each prefetch round trip also yields to the event loop.
+        if not self._prepared_reads:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    async for row in conn.cursor(_SERVERS_QUERY, prefetch=_SEED_BATCH_SIZE):
+                        yield row
+            return
+        await self._prepare_read_statements()
+        async with self._read_conn.transaction():
+            async for row in self._servers_stmt.cursor(prefetch=_SEED_BATCH_SIZE):
+                yield row
 
     async def _refresh_exclusions(self):
-        async with self._pool.acquire() as conn:
-            rows = await conn.fetch("SELECT type, value, server_ip, server_port FROM exclusions;")
+        rows = await self._fetch_exclusion_rows()
 
         temp_exclusions = {'gametype': set(), 'player_name': set(), 'server_id': set()}
         for row in rows:
@@ -44,36 +100,50 @@ class Scheduler:
                 continue
 
             if exclusion_type == 'server_id':
+                # Stored only as (ip, port) tuples so lookups never build "ip:port" strings.
                 server_ip = row['server_ip']
                 server_port = row['server_port']
-                value = row['value']
                 if server_ip and server_port:
                     temp_exclusions['server_id'].add((server_ip, server_port))
-                    temp_exclusions['server_id'].add(f"{server_ip}:{server_port}")
-                elif value:
-                    temp_exclusions['server_id'].add(value)
+                else:
+                    logger.warning("Ignoring malformed server_id exclusion '%s'.", row['value'])
             else:
                 temp_exclusions[exclusion_type].add(row['value'])
 
-        self._exclusions = temp_exclusions
+        exclusions = data_processor.Exclusions(
+            gametypes=frozenset(temp_exclusions['gametype']),
+            player_names=frozenset(temp_exclusions['player_name']),
+            server_ids=frozenset(temp_exclusions['server_id']),
+        )
+        if exclusions != self._exclusions:
+            # mv_player_advanced_stats filters on the exclusions table, so a change needs a refresh
+            # even when no new stats data arrives.
+            self._writes_since_refresh += 1
+        self._exclusions = exclusions
         logger.info(
             "Exclusions cache updated: %d gametypes, %d players, %d servers.",
-            len(self._exclusions['gametype']),
-            len(self._exclusions['player_name']),
-            len(self._exclusions['server_id']),
+            len(exclusions.gametypes),
+            len(exclusions.player_names),
+            len(exclusions.server_ids),
         )
 
-        for ip, port in list(self._parked_servers):
-            if not self._is_server_excluded(ip, port):
+        # Servers are only parked for server_id exclusions, so the release set is a plain difference.
+        released = self._parked_servers - exclusions.server_ids
+        if released:
+            self._parked_servers -= released
+            now = self._loop.time()
+            for ip, port in released:
                 logger.info(
                     "Releasing previously excluded server %s:%s back into the polling queue.",
                     ip,
                     port,
                 )
-                self._parked_servers.discard((ip, port))
-                await self._queue.put((time.time(), ip, port))
+                self._push(now, ip, port)
 
     async def _update_exclusions_cache(self):
+        # Seeding has just loaded the exclusions; a random start offsets this loop from the
+        # materialized view refresh so their queries don't land on Postgres together.
+        await asyncio.sleep(random.uniform(0, 60))
         while True:
             logger.info("Updating exclusions cache...")
             try:
@@ -89,30 +159,26 @@ class Scheduler:
         except Exception:
             logger.exception("Unable to refresh exclusions before seeding servers.")
 
+        now = self._loop.time()
+        seeded = 0
+        parked = 0
         try:
-            async with self._pool.acquire() as conn:
-                rows = await conn.fetch("SELECT ip, port FROM servers;")
+            async for row in self._iter_server_rows():
+                ip = row['ip']
+                port = row['port']
+                if (ip, port) in self._known_servers:
+                    continue
+                self._known_servers.add((ip, port))
+                if self._is_server_excluded(ip, port):
+                    self._parked_servers.add((ip, port))
+                    parked += 1
+                    continue
+                self._push(now, ip, port)
+                seeded += 1
         except Exception:
             logger.exception("Failed to load known servers from the database.")
             return
 
-        now = time.time()
-        seeded = 0
-        parked = 0
-        for row in rows:
-            ip = row['ip']
-            port = row['port']
-            server_identifier = f"{ip}:{port}"
-            if server_identifier in self._known_servers:
-                continue
-            self._known_servers.add(server_identifier)
-            if self._is_server_excluded(ip, port):
-                self._parked_servers.add((ip, port))
-                parked += 1
-                continue
-            await self._queue.put((now, ip, port))
-            seeded += 1
-
         logger.info(
             "Seeded %d servers into the polling queue (%d parked due to exclusions).",
             seeded,
@@ -121,11 +187,17 @@ class Scheduler:
 
     async def _refresh_materialized_views(self):
         while True:
-            await asyncio.sleep(300) 
+            await asyncio.sleep(300 + random.uniform(-30, 30))
+            if not self._writes_since_refresh:
+                logger.info("No new stats data since the last refresh; skipping materialized views.")
+                continue
             logger.info("Refreshing materialized views for stats...")
             try:
+                writes = self._writes_since_refresh
                 async with self._pool.acquire() as conn:
                     await conn.execute("REFRESH MATERIALIZED VIEW mv_player_advanced_stats;")
+                # Keep writes that landed during the refresh for the next cycle.
+                self._writes_since_refresh -= writes
                 logger.info("Materialized views refreshed.")
             except Exception:
                 logger.exception("Error refreshing materialized views.")
@@ -152,47 +224,84 @@ class Scheduler:
                 await asyncio.sleep(poll_interval)
                 continue
 
-            logger.info("Found %d servers in master list.", len(servers))
-            current_server_ids = {f"{ip}:{port}" for ip, port in servers}
-
-            new_servers = current_server_ids - self._known_servers
-            for server_id in new_servers:
-                ip, port_str = server_id.split(":")
-                port = int(port_str)
-                self._known_servers.add(server_id)
+            # The master list sends (ip, port) pairs, matching _known_servers, so discovery is a plain set difference.
+            current_servers = frozenset(servers)
+            logger.info("Found %d servers in master list.", len(current_servers))
+            known_servers = self._known_servers
+            if current_servers <= known_servers:
+                # Steady state: nothing new, so skip building a difference set.
+                await asyncio.sleep(poll_interval)
+                continue
+            new_servers = [server for server in current_servers if server not in known_servers]
+            now = self._loop.time()
+            for ip, port in new_servers:
+                self._known_servers.add((ip, port))
                 if self._is_server_excluded(ip, port):
                     logger.info("Discovered server %s:%s but it is currently excluded.", ip, port)
                     self._parked_servers.add((ip, port))
                     continue
                 logger.info("Discovered new server: %s:%s", ip, port)
-                await self._queue.put((time.time(), ip, port))
+                self._push(now, ip, port)
 
             await asyncio.sleep(poll_interval)
 
+    async def _dispatcher(self):
+        """Hands servers to workers as their poll deadlines come due."""
+        while True:
+            if not self._heap:
+                self._waker.clear()
+                await self._waker.wait()
+                continue
+
+            delay = self._heap[0][0] - self._loop.time()
+            if delay > 0:
+                self._waker.clear()
+                try:
+                    await asyncio.wait_for(self._waker.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, ip, port = heapq.heappop(self._heap)
+            await self._work_queue.put((ip, port))
+
+    async def _writer(self):
+        """Records successful polls in batches, one transaction per batch."""
+        queue = self._write_batch
+        while True:
+            item = await queue.get()
+            # Let polls finishing around the same time join this batch.
+            await asyncio.sleep(settings.WRITE_BATCH_INTERVAL_S)
+            batch = [item]
+            while len(batch) < settings.WRITE_BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            try:
+                self._writes_since_refresh += await data_processor.process_batch(
+                    self._pool, batch, self._exclusions
+                )
+            except Exception:
+                logger.exception("Error recording a batch of %d poll results.", len(batch))
+
     async def _worker(self, worker_id: int):
         logger.info("Worker %d started.", worker_id)
         while True:
-            next_poll_time, ip, port = await self._queue.get()
+            ip, port = await self._work_queue.get()
 
-            if self._is_server_excluded(ip, port):
+            if (ip, port) in self._exclusions.server_ids:
                 logger.debug("Skipping excluded server %s:%s before polling.", ip, port)
-                self._queue.task_done()
                 self._parked_servers.add((ip, port))
                 continue
 
-            sleep_duration = next_poll_time - time.time()
-            if sleep_duration > 0:
-                await asyncio.sleep(sleep_duration)
-
             result = await server_querier.query_server(ip, port)
 
-            now = time.time()
+            now = self._loop.time()
             if result:
-                await data_processor.process_server_success(self._pool, ip, port, result, self._exclusions)
-                
+                await self._write_batch.put((ip, port, result))
+
                 info = result.info
-                num_players = _safe_int(info.get('numplayers'))
-                time_remaining = _safe_int(info.get('roundtimeremain') or info.get('roundtime'))
+                num_players = data_processor._coerce_int(info.get('numplayers'))
+                time_remaining = data_processor._coerce_int(info.get('roundtimeremain') or info.get('roundtime'))
 
                 delay = settings.POLL_INTERVAL_ACTIVE_S
 
@@ -207,32 +316,29 @@ class Scheduler:
                         delay,
                     )
             else:
-                await data_processor.process_server_failure(self._pool, ip, port)
+                if await data_processor.process_server_failure(self._pool, ip, port):
+                    self._writes_since_refresh += 1
                 delay = settings.POLL_INTERVAL_OFFLINE_S
 
-            await self._queue.put((now + delay, ip, port))
-            self._queue.task_done()
+            self._push(now + delay, ip, port)
 
     async def run(self):
+        self._loop = asyncio.get_running_loop()
         self._pool = await self._db_manager.get_pool()
         await self._seed_known_servers()
 
-        tasks = [
-            asyncio.create_task(self._master_list_poller(), name="master-list-poller"),
-            asyncio.create_task(self._refresh_materialized_views(), name="refresh-materialized-views"),
-            asyncio.create_task(self._update_exclusions_cache(), name="exclusions-cache"),
-        ]
-        for i in range(self._worker_count):
-            tasks.append(asyncio.create_task(self._worker(i), name=f"worker-{i}"))
-        logger.info("Ingestion engine scheduler is running with %d workers.", self._worker_count)
-
+        # Cancelling run() (or any task failing) cancels every other task before the cleanup below.
         try:
-            await asyncio.gather(*tasks)
-        except asyncio.CancelledError:
-            logger.info("Scheduler run cancelled.")
-            raise
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self._dispatcher(), name="dispatcher")
+                tg.create_task(self._writer(), name="writer")
+                tg.create_task(self._master_list_poller(), name="master-list-poller")
+                tg.create_task(self._refresh_materialized_views(), name="refresh-materialized-views")
+                tg.create_task(self._update_exclusions_cache(), name="exclusions-cache")
+                for i in range(self._worker_count):
+                    tg.create_task(self._worker(i), name=f"worker-{i}")
+                logger.info("Ingestion engine scheduler is running with %d workers.", self._worker_count)
         finally:
-            for task in tasks:
-                task.cancel()
-            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._release_read_conn()
             await master_list.close_session()
+            server_querier.close_endpoint()
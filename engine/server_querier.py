@@ -1,5 +1,7 @@
-from opengsq.protocols import GameSpy1
-from typing import Dict, Optional
+import asyncio
+import re
+import socket
+from typing import Dict, List, NamedTuple, Optional, Tuple
 import logging
 from .config import settings
 
@@ -7,55 +9,288 @@ from .config import settings
 logger = logging.getLogger(__name__)
 
 
-async def query_server(ip: str, port: int) -> Optional[Dict]:
-    timeout = settings.SERVER_QUERY_TIMEOUT_S / 2
-    primary_error = None
+_STATUS_REQUEST = b'\\status\\'
+_FINAL_MARKER = b'\\final\\'
+_QUERY_ID_MARKER = b'\\queryid\\'
+_INDEXED_KEY = re.compile(r'^(.+)_(\d+)$')
+# Status keys repeat across polls ("player_0", "score_0", "hostname", ...), so each key is
+# normalized and split into (field, index) once and memoized here; index is None for server info.
+_KEY_CACHE: Dict[str, Tuple[str, Optional[int]]] = {}
+_KEY_CACHE_MAX_SIZE = 4096
+# BF1942 reports player names as playername_N; the rest of the engine reads 'player'.
+_FIELD_ALIASES = {'playername': 'player'}
+
+
+class ServerStatus(NamedTuple):
+    info: Dict[str, str]
+    players: List[Dict[str, str]]
+
+
+class _PendingQuery:
+    """Reassembles a GameSpy1 response that may be split over several datagrams."""
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.waiters = 0
+        self._packets: Dict[int, bytes] = {}
+        self._packet_count: Optional[int] = None
+
+    def feed(self, packet: bytes):
+        if self.future.done():
+            return
+
+        # The last packet carries \final\ either before or after its \queryid\<id>.<sequence>
+        # trailer, so strip the marker on both sides of the trailer.
+        is_final = packet.endswith(_FINAL_MARKER)
+        if is_final:
+            packet = packet[:-len(_FINAL_MARKER)]
+
+        # Servers that send a single packet sometimes omit the trailer.
+        body, marker, query_id = packet.rpartition(_QUERY_ID_MARKER)
+        sequence = 1
+        if marker:
+            try:
+                sequence = int(query_id.partition(b'.')[2])
+            except ValueError:
+                pass
+        else:
+            body = packet
+
+        if body.endswith(_FINAL_MARKER):
+            is_final = True
+            body = body[:-len(_FINAL_MARKER)]
+
+        self._packets[sequence] = body
+        if is_final:
+            self._packet_count = sequence
+        if self._packet_count is not None and len(self._packets) >= self._packet_count:
+            self.future.set_result(b''.join(self._packets[i] for i in sorted(self._packets)))
+
+
+class _GameSpy1Protocol(asyncio.DatagramProtocol):
+    """One UDP socket shared by every status query; replies are matched by source address."""
+
+    def __init__(self):
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self._pending: Dict[Tuple[str, int], _PendingQuery] = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        pending = self._pending.get(addr[:2])
+        if pending is not None:
+            pending.feed(data)
+
+    def error_received(self, exc: Exception):
+        logger.debug("UDP query socket reported %s: %s", type(exc).__name__, exc)
+
+    def connection_lost(self, exc: Optional[Exception]):
+        self.transport = None
+        for pending in self._pending.values():
+            if not pending.future.done():
+                pending.future.set_exception(ConnectionError("UDP query socket closed"))
+        self._pending.clear()
+
+    async def query(self, ip: str, port: int, timeout: float) -> bytes:
+        addr = (ip, port)
+        pending = self._pending.get(addr)
+        if pending is None:
+            # Concurrent queries to the same address share one request and its reply.
+            pending = _PendingQuery(asyncio.get_running_loop().create_future())
+            self._pending[addr] = pending
+            self.transport.sendto(_STATUS_REQUEST, addr)
+
+        pending.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(pending.future), timeout)
+        finally:
+            pending.waiters -= 1
+            if pending.waiters == 0 and self._pending.get(addr) is pending:
+                del self._pending[addr]
+                if not pending.future.done():
+                    pending.future.cancel()
+
+
+_endpoint: Optional[_GameSpy1Protocol] = None
+_endpoint_lock = asyncio.Lock()
+
+
+async def _get_endpoint() -> _GameSpy1Protocol:
+    global _endpoint
+    if _endpoint is not None and _endpoint.transport is not None:
+        return _endpoint
+    async with _endpoint_lock:
+        if _endpoint is None or _endpoint.transport is None:
+            loop = asyncio.get_running_loop()
+            _, _endpoint = await loop.create_datagram_endpoint(_GameSpy1Protocol, sock=_open_query_socket())
+    return _endpoint
+
+
+def _open_query_socket() -> socket.socket:
+    # Every in-flight reply lands in this one socket's buffer; the default is too small to absorb
+    # bursts from hundreds of concurrent multi-packet replies while the event loop is busy.
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
-        gs1 = GameSpy1(host=ip, port=port, timeout=timeout)
-        status = await gs1.get_status()
-        return status
-    except Exception as exc:
-        primary_error = exc
+        requested = settings.SERVER_QUERY_RECV_BUFFER_BYTES
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, requested)
+            applied = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        except OSError as exc:
+            logger.warning("Could not set the UDP query socket receive buffer: %s", exc)
+        else:
+            # Linux reports double the size it applied.
+            if applied < requested:
+                logger.warning(
+                    "UDP query socket receive buffer is %d bytes, below the requested %d; "
+                    "raise net.core.rmem_max to allow more.",
+                    applied,
+                    requested,
+                )
+        sock.setblocking(False)
+        sock.bind(('0.0.0.0', 0))
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def close_endpoint():
+    global _endpoint
+    if _endpoint is not None and _endpoint.transport is not None:
+        _endpoint.transport.close()
+    _endpoint = None
+
+
+def _split_key(key: str) -> Tuple[str, Optional[int]]:
+    normalized = key.strip().lower()
+    match = _INDEXED_KEY.match(normalized)
+    if match is None:
+        split = (normalized, None)
+    else:
+        field = match.group(1)
+        split = (_FIELD_ALIASES.get(field, field), int(match.group(2)))
+    # Bounded because info keys come from arbitrary servers.
+    if len(_KEY_CACHE) < _KEY_CACHE_MAX_SIZE:
+        _KEY_CACHE[key] = split
+    return split
+
+
+def _parse_status(payload: bytes) -> ServerStatus:
+    """Splits a \\key\\value\\... status payload into server info and per-player fields.
 
+    Keys are lowercased, values stripped, and players repeating an earlier keyhash dropped.
+    """
+    parts = payload.decode('utf-8', errors='ignore').split('\\')
+    info: Dict[str, str] = {}
+    players: Dict[int, Dict[str, str]] = {}
+    key_cache = _KEY_CACHE
+    # parts[0] is the empty string before the leading backslash.
+    for key, value in zip(parts[1::2], parts[2::2]):
+        split = key_cache.get(key)
+        if split is None:
+            split = _split_key(key)
+        field, index = split
+        if index is None:
+            info[field] = value.strip()
+            continue
+        if field == 'teamname':
+            continue
+        player = players.get(index)
+        if player is None:
+            player = players[index] = {}
+        player[field] = value.strip()
+
+    # BF1942 sometimes lists the same player twice; keep the first entry per keyhash.
+    player_list = []
+    seen_keyhashes = set()
+    for index in sorted(players):
+        player = players[index]
+        keyhash = player.get('keyhash')
+        if keyhash:
+            if keyhash in seen_keyhashes:
+                continue
+            seen_keyhashes.add(keyhash)
+        player_list.append(player)
+    return ServerStatus(info, player_list)
+
+
+async def _get_status(ip: str, port: int, timeout: float) -> ServerStatus:
+    endpoint = await _get_endpoint()
+    payload = await endpoint.query(ip, port, timeout)
+    return _parse_status(payload)
+
+
+async def query_server(
+    ip: str,
+    port: int,
+    fast_timeout: Optional[float] = None,
+    full_timeout: Optional[float] = None,
+) -> Optional[ServerStatus]:
+    """Queries a server's status, or returns None if neither query port answers.
+
+    The listed port fails fast after fast_timeout; the port 23000 query gets full_timeout.
+    Both default to their settings.
+    """
+    if fast_timeout is None:
+        fast_timeout = settings.SERVER_QUERY_FAST_TIMEOUT_S
+    if full_timeout is None:
+        full_timeout = settings.SERVER_QUERY_TIMEOUT_S
     standard_query_port = 23000
-    if port != standard_query_port:
+    if port == standard_query_port:
         try:
-            gs1 = GameSpy1(host=ip, port=standard_query_port, timeout=timeout)
-            status = await gs1.get_status()
-            if primary_error:
-                logger.info(
-                    "Primary query for %s:%s failed with %s; fallback to %s succeeded.",
-                    ip,
-                    port,
-                    type(primary_error).__name__,
-                    standard_query_port,
-                )
-            return status
+            return await _get_status(ip, port, full_timeout)
         except Exception as exc:
             logger.warning(
-                "Fallback query failed for %s:%s via %s with %s: %s",
+                "Query for %s:%s failed with %s: %s",
                 ip,
                 port,
-                standard_query_port,
                 type(exc).__name__,
                 exc,
             )
-            if primary_error:
-                logger.warning(
-                    "Primary query for %s:%s previously failed with %s: %s",
-                    ip,
-                    port,
-                    type(primary_error).__name__,
-                    primary_error,
-                )
             return None
 
-    if primary_error:
+    # Query the listed port and the standard query port together; prefer the listed port.
+    primary = asyncio.create_task(_get_status(ip, port, fast_timeout))
+    fallback = asyncio.create_task(_get_status(ip, standard_query_port, full_timeout))
+    try:
+        done, _ = await asyncio.wait({primary, fallback}, return_when=asyncio.FIRST_COMPLETED)
+        if primary in done and primary.exception() is None:
+            return primary.result()
+
+        # Either the primary failed, or the fallback answered first and the primary may still succeed.
+        await asyncio.wait({primary, fallback})
+        if primary.exception() is None:
+            return primary.result()
+        primary_error = primary.exception()
+        if fallback.exception() is None:
+            logger.info(
+                "Primary query for %s:%s failed with %s; fallback to %s succeeded.",
+                ip,
+                port,
+                type(primary_error).__name__,
+                standard_query_port,
+            )
+            return fallback.result()
+
+        fallback_error = fallback.exception()
+        logger.warning(
+            "Fallback query failed for %s:%s via %s with %s: %s",
+            ip,
+            port,
+            standard_query_port,
+            type(fallback_error).__name__,
+            fallback_error,
+        )
         logger.warning(
-            "Query for %s:%s failed with %s: %s",
+            "Primary query for %s:%s previously failed with %s: %s",
             ip,
             port,
             type(primary_error).__name__,
             primary_error,
         )
-    return None
+        return None
+    finally:
+        for task in (primary, fallback):
+            task.cancel()
+        await asyncio.gather(primary, fallback, return_exceptions=True)
@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import uvloop
 from engine.scheduler import Scheduler
 from engine.database import Database
 
@@ -27,6 +28,7 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        # libuv-based event loop; the engine is entirely socket I/O (UDP queries and Postgres).
+        uvloop.run(main())
     except KeyboardInterrupt:
         logger.info("Shutdown requested by user.")
@@ -3,13 +3,13 @@ import argparse
 import asyncpg
 from engine.config import settings
 
-async def list_exclusions(pool, exclusion_type):
+async def list_exclusions(conn, exclusion_type):
     """Lists all exclusions, optionally filtered by type."""
     print("--- Current Exclusions ---")
     if exclusion_type:
-        rows = await pool.fetch("SELECT id, type, value, notes FROM exclusions WHERE type = $1 ORDER BY type, value;", exclusion_type)
+        rows = await conn.fetch("SELECT id, type, value, notes FROM exclusions WHERE type = $1 ORDER BY type, value;", exclusion_type)
     else:
-        rows = await pool.fetch("SELECT id, type, value, notes FROM exclusions ORDER BY type, value;")
+        rows = await conn.fetch("SELECT id, type, value, notes FROM exclusions ORDER BY type, value;")
 
     if not rows:
         print("No exclusions found.")
@@ -18,22 +18,23 @@ async def list_exclusions(pool, exclusion_type):
     for row in rows:
         print(f"ID: {row['id']:<4} Type: {row['type']:<20} Value: {row['value']:<25} Notes: {row['notes'] or ''}")
 
-async def add_exclusion(pool, exclusion_type, value, notes):
+async def add_exclusion(conn, exclusion_type, value, notes):
     """Adds a new exclusion to the database."""
     try:
-        await pool.execute(
-            "INSERT INTO exclusions (type, value, notes) VALUES ($1, $2, $3);",
+        exclusion_id = await conn.fetchval(
+            "INSERT INTO exclusions (type, value, notes) VALUES ($1, $2, $3) ON CONFLICT (type, value) DO NOTHING RETURNING id;",
             exclusion_type, value, notes
         )
-        print(f"✅ Successfully added exclusion: [Type: {exclusion_type}, Value: {value}]")
-    except asyncpg.exceptions.UniqueViolationError:
-        print(f"⚠️ Error: An exclusion for [Type: {exclusion_type}, Value: {value}] already exists.")
+        if exclusion_id is None:
+            print(f"⚠️ Error: An exclusion for [Type: {exclusion_type}, Value: {value}] already exists.")
+        else:
+            print(f"✅ Successfully added exclusion: [Type: {exclusion_type}, Value: {value}]")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
-async def remove_exclusion(pool, exclusion_id):
+async def remove_exclusion(conn, exclusion_id):
     """Removes an exclusion by its ID."""
-    result = await pool.execute("DELETE FROM exclusions WHERE id = $1;", exclusion_id)
+    result = await conn.execute("DELETE FROM exclusions WHERE id = $1;", exclusion_id)
     if result == 'DELETE 1':
         print(f"✅ Successfully removed exclusion with ID: {exclusion_id}")
     else:
@@ -58,16 +59,21 @@ async def main():
 
     args = parser.parse_args()
     
-    pool = await asyncpg.create_pool(dsn=settings.POSTGRES_DSN)
+    # A one-shot command only needs a single connection, not a pool.
+    conn = await asyncpg.connect(
+        dsn=settings.POSTGRES_DSN,
+        statement_cache_size=settings.POSTGRES_STATEMENT_CACHE_SIZE,
+    )
 
-    if args.command == "list":
-        await list_exclusions(pool, args.type)
-    elif args.command == "add":
-        await add_exclusion(pool, args.type, args.value, args.notes)
-    elif args.command == "remove":
-        await remove_exclusion(pool, args.id)
-
-    await pool.close()
+    try:
+        if args.command == "list":
+            await list_exclusions(conn, args.type)
+        elif args.command == "add":
+            await add_exclusion(conn, args.type, args.value, args.notes)
+        elif args.command == "remove":
+            await remove_exclusion(conn, args.id)
+    finally:
+        await conn.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
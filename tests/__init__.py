@@ -0,0 +1,4 @@
+import os
+
+# engine.config requires a DSN at import time; the tests never connect.
+os.environ.setdefault("POSTGRES_DSN", "postgresql://localhost/bf1942_test")
@@ -0,0 +1,132 @@
+import asyncio
+import unittest
+
+from engine.server_querier import ServerStatus, _PendingQuery, _parse_status
+
+
+# Trimmed from BF1942 1.61 \status\ replies.
+SINGLE_PACKET = (
+    b'\\hostname\\Desert Combat Rats \\gamename\\bfield1942\\gamever\\v1.61'
+    b'\\mapname\\El_Alamein\\gametype\\conquest\\gamemode\\openplaying'
+    b'\\numplayers\\2\\maxplayers\\64\\roundtimeremain\\1187\\active_mods\\bf1942'
+    b'\\teamname_0\\Axis\\teamname_1\\Allies'
+    b'\\playername_0\\Bob \\keyhash_0\\0f1e2d3c4b5a69788796a5b4c3d2e1f0\\score_0\\12'
+    b'\\kills_0\\4\\deaths_0\\2\\ping_0\\48\\team_0\\1'
+    b'\\playername_1\\ Alice\\keyhash_1\\aabbccddeeff00112233445566778899\\score_1\\7'
+    b'\\kills_1\\3\\deaths_1\\5\\ping_1\\112\\team_1\\2'
+    b'\\final\\\\queryid\\12.1'
+)
+
+MULTI_PACKET_1 = (
+    b'\\hostname\\=DoG= Battlefield\\gamever\\v1.61\\mapname\\Wake\\gametype\\conquest'
+    b'\\numplayers\\2\\roundtimeremain\\640'
+    b'\\playername_0\\Sgt.Pepper\\keyhash_0\\11111111111111111111111111111111'
+    b'\\queryid\\34.1'
+)
+MULTI_PACKET_2 = (
+    b'\\score_0\\30\\kills_0\\9\\deaths_0\\1\\ping_0\\60\\team_0\\1'
+    b'\\playername_1\\Rookie\\keyhash_1\\22222222222222222222222222222222\\score_1\\0'
+    b'\\queryid\\34.2\\final\\'
+)
+
+DUPLICATE_KEYHASH = (
+    b'\\hostname\\Dupes\\numplayers\\3'
+    b'\\playername_0\\Bob\\keyhash_0\\aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa\\score_0\\10'
+    b'\\playername_1\\Bob\\keyhash_1\\aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa\\score_1\\10'
+    b'\\playername_2\\Carol\\keyhash_2\\bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb\\score_2\\3'
+    b'\\final\\\\queryid\\5.1'
+)
+
+
+async def _reassemble(*packets: bytes) -> ServerStatus:
+    pending = _PendingQuery(asyncio.get_running_loop().create_future())
+    for packet in packets:
+        pending.feed(packet)
+    payload = await asyncio.wait_for(pending.future, 1)
+    return _parse_status(payload)
+
+
+class ParseStatusTests(unittest.TestCase):
+    def test_info_keys_and_values_are_normalized(self):
+        status = _parse_status(b'\\HostName\\  Padded Server \\MapName\\Wake')
+        self.assertEqual(status.info, {'hostname': 'Padded Server', 'mapname': 'Wake'})
+        self.assertEqual(status.players, [])
+
+    def test_playername_is_reported_as_player(self):
+        status = _parse_status(b'\\playername_0\\Bob \\Score_0\\5')
+        self.assertEqual(status.players, [{'player': 'Bob', 'score': '5'}])
+
+    def test_teamnames_are_not_players(self):
+        status = _parse_status(b'\\teamname_0\\Axis\\teamname_1\\Allies\\numplayers\\0')
+        self.assertEqual(status.players, [])
+        self.assertEqual(status.info, {'numplayers': '0'})
+
+    def test_duplicate_keyhash_keeps_first_player(self):
+        status = _parse_status(DUPLICATE_KEYHASH.rpartition(b'\\final\\')[0])
+        self.assertEqual([player['player'] for player in status.players], ['Bob', 'Carol'])
+
+    def test_players_without_keyhash_are_kept(self):
+        status = _parse_status(b'\\playername_0\\Bot\\keyhash_0\\\\playername_1\\Bot2\\keyhash_1\\')
+        self.assertEqual([player['player'] for player in status.players], ['Bot', 'Bot2'])
+
+
+class ReassemblyTests(unittest.IsolatedAsyncioTestCase):
+    async def test_single_packet_with_final_before_queryid(self):
+        status = await _reassemble(SINGLE_PACKET)
+        self.assertEqual(status.info['hostname'], 'Desert Combat Rats')
+        self.assertEqual(status.info['roundtimeremain'], '1187')
+        self.assertNotIn('queryid', status.info)
+        self.assertNotIn('final', status.info)
+        self.assertEqual(
+            status.players,
+            [
+                {
+                    'player': 'Bob',
+                    'keyhash': '0f1e2d3c4b5a69788796a5b4c3d2e1f0',
+                    'score': '12',
+                    'kills': '4',
+                    'deaths': '2',
+                    'ping': '48',
+                    'team': '1',
+                },
+                {
+                    'player': 'Alice',
+                    'keyhash': 'aabbccddeeff00112233445566778899',
+                    'score': '7',
+                    'kills': '3',
+                    'deaths': '5',
+                    'ping': '112',
+                    'team': '2',
+                },
+            ],
+        )
+
+    async def test_single_packet_without_queryid(self):
+        status = await _reassemble(b'\\hostname\\Bare\\numplayers\\0\\final\\')
+        self.assertEqual(status.info, {'hostname': 'Bare', 'numplayers': '0'})
+
+    async def test_multi_packet_out_of_order(self):
+        status = await _reassemble(MULTI_PACKET_2, MULTI_PACKET_1)
+        self.assertEqual(status.info['mapname'], 'Wake')
+        self.assertEqual(
+            [(player['player'], player['score']) for player in status.players],
+            [('Sgt.Pepper', '30'), ('Rookie', '0')],
+        )
+
+    async def test_multi_packet_waits_for_missing_packet(self):
+        pending = _PendingQuery(asyncio.get_running_loop().create_future())
+        pending.feed(MULTI_PACKET_2)
+        self.assertFalse(pending.future.done())
+        pending.feed(MULTI_PACKET_1)
+        self.assertTrue(pending.future.done())
+
+    async def test_duplicate_keyhash_reply(self):
+        status = await _reassemble(DUPLICATE_KEYHASH)
+        self.assertEqual(
+            [(player['player'], player['score']) for player in status.players],
+            [('Bob', '10'), ('Carol', '3')],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()